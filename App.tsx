@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { ChatMessage, MemoryItem, OllamaStatus } from './types';
-import { checkStatus, sendChat, getModels, getHistory, getMemories, getSummarizerStatus, updateMemory, buildPrompt, inferWithPrompt } from './services/ollamaService';
+import { checkStatus, streamChat, getModels, getHistory, getMemories, getPendingMemories, getSummarizerStatus, updateMemory, buildPrompt, streamInferWithPrompt } from './services/ollamaService';
 import MemoryPanel from './components/MemoryPanel';
 import ChatPanel from './components/ChatPanel';
 import MessageInput from './components/MessageInput';
@@ -65,6 +65,16 @@ const App: React.FC = () => {
           if (history.length > 0) setMessages(history as any); 
       });
   }, [checkOllamaStatus]);
+
+  // [NEW] The sidecar summarizer runs after /chat responds; poll for the memories it creates
+  useEffect(() => {
+      const timer = setInterval(() => {
+          getPendingMemories().then(mems => {
+              if (mems.length > 0) setLongTermMemory(prev => [...mems.reverse(), ...prev]);
+          });
+      }, 5000);
+      return () => clearInterval(timer);
+  }, []);
   
   const handleSendMessage = async (input: string) => {
     if (!input.trim() || isLoading || isBuildingPrompt) return;
@@ -106,23 +116,27 @@ const App: React.FC = () => {
     setMessages(prev => [...prev, { id: assistantMessageId, role: 'assistant', content: '' }]);
     
     try {
-        let data;
+        const appendToken = (token: string) => {
+            setMessages(prev => prev.map(msg =>
+                msg.id === assistantMessageId ? { ...msg, content: msg.content + token } : msg
+            ));
+        };
+        let fullText: string;
         if (overriddenPrompt) {
-             // Use new Inference Endpoint (Inspector Flow)
-             data = await inferWithPrompt(overriddenPrompt, model, originalInput, activeSummarizer);
+             // Use new Inference Endpoint (Inspector Flow), streamed as server-sent events
+             fullText = await streamInferWithPrompt(overriddenPrompt, model, originalInput, activeSummarizer, appendToken, abortControllerRef.current?.signal);
         } else {
-             // Use Standard Endpoint (Direct Flow)
-             data = await sendChat(model, originalInput, systemPrompt, true, activeSummarizer);
+             // Use Standard Endpoint (Direct Flow), rendering tokens as they stream in
+             fullText = await streamChat(model, originalInput, systemPrompt, true, activeSummarizer, appendToken, abortControllerRef.current?.signal);
         }
         
         setMessages(prev => prev.map(msg => 
-            msg.id === assistantMessageId ? { ...msg, content: data.response } : msg
+            msg.id === assistantMessageId ? { ...msg, content: fullText } : msg
         ));
-
-        if (data.new_memory) {
-            setLongTermMemory(prev => [data.new_memory, ...prev]);
-        }
+        // New memories arrive through /pending_memories once the sidecar finishes
     } catch (error) {
+         // Stop aborts the fetch: keep whatever was streamed so far
+         if (error instanceof Error && error.name === 'AbortError') return;
          setMessages(prev => prev.map(msg => 
           msg.id === assistantMessageId ? { ...msg, content: 'Error during inference.' } : msg
         ));
@@ -1,116 +1,273 @@
 import sqlite3
 import os
+import asyncio
+import atexit
 import logging
-import json
+import orjson
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 logger = logging.getLogger(__name__)
 DB_PATH = "localmind.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Connection tuning, applied once per connection when it is first opened.
+# WAL lets readers proceed while a write is in flight; NORMAL sync is safe under WAL.
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",  # ~64MB page cache
+    "PRAGMA mmap_size=268435456",  # read pages straight from a 256MB memory map
+)
+
+# One long-lived connection per thread (FastAPI runs sync handlers on a threadpool)
+_local = threading.local()
+_all_connections = []
+_registry_lock = threading.Lock()
+
+# SQLite allows a single writer at a time; serialize our writes explicitly
+write_lock = threading.Lock()
+
+def _open_connection():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row # Access columns by name
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    if getattr(_local, "read_only", False):
+        # Reader-pool connections can never take the write lock by accident
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+def _mark_reader_thread():
+    _local.read_only = True
+
+def get_db_connection():
+    """
+    Returns the calling thread's persistent connection, opening it on first use.
+    Callers must NOT close it; it is closed at interpreter shutdown.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+        with _registry_lock:
+            _all_connections.append(conn)
     return conn
 
+# --- ASYNC ACCESS ---
+# Async endpoints must never run sqlite3 on the event loop. Reads are dispatched to a
+# small dedicated pool of threads; each thread keeps its own persistent connection,
+# so this doubles as a pool of READ_POOL_SIZE connections. Writes go through a single
+# writer thread (one writer connection), which serializes them without blocking the loop.
+READ_POOL_SIZE = 5
+_read_executor = ThreadPoolExecutor(
+    max_workers=READ_POOL_SIZE, thread_name_prefix="localmind-db-read", initializer=_mark_reader_thread
+)
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="localmind-db-write")
+
+async def run_read(func, *args, **kwargs):
+    """Runs a blocking read helper on the reader pool and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor, partial(func, *args, **kwargs))
+
+async def run_write(func, *args, **kwargs):
+    """Runs a blocking write helper on the dedicated writer thread and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_executor, partial(func, *args, **kwargs))
+
+@atexit.register
+def close_all_connections():
+    """Closes every cached connection (registered as an atexit hook)."""
+    with _registry_lock:
+        while _all_connections:
+            conn = _all_connections.pop()
+            try:
+                # Recommended right before closing a long-lived connection (may write stats)
+                conn.execute("PRAGMA query_only=OFF")
+                conn.execute("PRAGMA analysis_limit=400")
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except Exception as e:
+                logger.warning(f"Error closing database connection: {e}")
+
+# --- SCHEMA ---
+# Note: If a table exists from an older version, its CREATE is skipped,
+# and the _migrate_schema function handles any missing columns.
+SCHEMA_DDL = """
+    -- Users Table
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        password_hash TEXT,
+        display_name TEXT,
+        workspace TEXT,
+        preferences TEXT
+    );
+
+    -- Model Configs Table
+    CREATE TABLE IF NOT EXISTS model_configs (
+        model_id TEXT PRIMARY KEY,
+        display_name TEXT,
+        context_limit INTEGER,
+        base_system_prompt TEXT
+    );
+
+    -- System Prompts Table
+    CREATE TABLE IF NOT EXISTS system_prompts (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        content TEXT,
+        user_id TEXT,
+        is_public BOOLEAN DEFAULT 0
+    );
+
+    -- Chats Table
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT,
+        role TEXT,
+        content TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        model_used TEXT,
+        is_summarized BOOLEAN DEFAULT 0
+    );
+
+    -- Recent-history reads walk this index backwards instead of sorting the table.
+    -- id is monotonic, so it orders turns exactly (timestamps tie within a second).
+    CREATE INDEX IF NOT EXISTS idx_chats_session_id ON chats(session_id, id DESC);
+
+    -- Session Summaries Table
+    CREATE TABLE IF NOT EXISTS session_summaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT,
+        content TEXT,
+        start_chat_id INTEGER,
+        end_chat_id INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- get_session_summary reads every chapter of one session in id order
+    CREATE INDEX IF NOT EXISTS idx_summaries_session_id ON session_summaries(session_id, id);
+"""
+
+# --- MIGRATIONS ---
+# Column/data changes for databases created by older versions, tracked in PRAGMA user_version
+# (an integer in the DB header, so checking for pending migrations is O(1)).
+# Idempotent objects (tables, indexes) belong in SCHEMA_DDL instead.
+
+def _migrate_to_v1(cursor):
+    """v1: 'chats.is_summarized' (databases created before session compaction existed)."""
+    cursor.execute("PRAGMA table_info(chats)")
+    columns = [info[1] for info in cursor.fetchall()]
+    
+    if 'is_summarized' not in columns:
+        logger.info("Migration: Adding 'is_summarized' column to 'chats' table.")
+        cursor.execute("ALTER TABLE chats ADD COLUMN is_summarized BOOLEAN DEFAULT 0")
+
+def _migrate_to_v2(cursor):
+    """v2: history is ordered by id; the old (session_id, timestamp) index is superseded."""
+    cursor.execute("DROP INDEX IF EXISTS idx_chats_session_ts")
+
+def _migrate_to_v3(cursor):
+    """v3: partial index over the unsummarized tail that check_and_compact probes and reads."""
+    # Lives here rather than in SCHEMA_DDL: it needs 'is_summarized', which v1 may have just added
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chats_unsummarized ON chats(session_id, id) WHERE is_summarized = 0"
+    )
+
+_MIGRATIONS = (
+    (1, _migrate_to_v1),
+    (2, _migrate_to_v2),
+    (3, _migrate_to_v3),
+)
+CURRENT_SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
 def _migrate_schema(cursor):
     """
-    Checks for missing columns in existing tables and alters them if necessary.
-    This handles updates on databases that already exist.
+    Runs every migration newer than the database's user_version, in order.
+    Must be called inside a transaction so a failed step leaves the schema untouched.
     """
-    # 1. Check 'chats' table for 'is_summarized' column
-    try:
-        cursor.execute("PRAGMA table_info(chats)")
-        columns = [info[1] for info in cursor.fetchall()]
-        
-        if columns and 'is_summarized' not in columns:
-            logger.info("Migration: Adding 'is_summarized' column to 'chats' table.")
-            cursor.execute("ALTER TABLE chats ADD COLUMN is_summarized BOOLEAN DEFAULT 0")
-            
-    except Exception as e:
-        logger.error(f"Migration failed: {e}")
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version > CURRENT_SCHEMA_VERSION:
+        logger.warning(f"Database schema v{version} is newer than this build (v{CURRENT_SCHEMA_VERSION}); skipping migrations.")
+        return
+    for target, migrate in _MIGRATIONS:
+        if version < target:
+            migrate(cursor)
+            cursor.execute(f"PRAGMA user_version = {target}")
+            version = target
 
 def init_db():
     """Creates tables if they don't exist and performs migrations."""
     conn = get_db_connection()
+    _quick_check(conn)
+    with write_lock:
+        _create_and_seed(conn)
+    optimize_db()
+    logger.info("Database initialized and checked.")
+
+def _quick_check(conn):
+    """Fast integrity validation; problems are logged, not fatal."""
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA quick_check").fetchall()]
+        if problems != ["ok"]:
+            for problem in problems:
+                logger.error(f"Database integrity problem: {problem}")
+    except Exception as e:
+        logger.error(f"PRAGMA quick_check failed: {e}")
+
+# --- PLANNER STATISTICS ---
+# PRAGMA optimize refreshes statistics only for tables whose contents changed noticeably,
+# so it is cheap to run at startup, shutdown and every OPTIMIZE_EVERY_WRITES writes.
+OPTIMIZE_EVERY_WRITES = 500
+_writes_since_optimize = 0
+
+def optimize_db():
+    """Runs a bounded ANALYZE pass on the calling thread's connection."""
+    conn = get_db_connection()
+    try:
+        conn.execute("PRAGMA analysis_limit=400")
+        conn.execute("PRAGMA optimize")
+    except Exception as e:
+        logger.warning(f"PRAGMA optimize failed: {e}")
+
+def record_writes(count=1):
+    """Counts committed writes and triggers optimize_db() periodically. Call while holding write_lock."""
+    global _writes_since_optimize
+    _writes_since_optimize += count
+    if _writes_since_optimize >= OPTIMIZE_EVERY_WRITES:
+        _writes_since_optimize = 0
+        optimize_db()
+
+def _create_and_seed(conn):
     cursor = conn.cursor()
     
     # --- 1. Define Tables (Ideal Schema) ---
-
-    # Users Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            password_hash TEXT,
-            display_name TEXT,
-            workspace TEXT,
-            preferences TEXT
-        )
-    ''')
-
-    # Model Configs Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS model_configs (
-            model_id TEXT PRIMARY KEY,
-            display_name TEXT,
-            context_limit INTEGER,
-            base_system_prompt TEXT
-        )
-    ''')
-
-    # System Prompts Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS system_prompts (
-            id TEXT PRIMARY KEY,
-            name TEXT,
-            content TEXT,
-            user_id TEXT,
-            is_public BOOLEAN DEFAULT 0
-        )
-    ''')
-
-    # Chats Table
-    # Note: If this table exists from an older version, this CREATE is skipped,
-    # and the _migrate_schema function handles the missing column.
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            role TEXT,
-            content TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            model_used TEXT,
-            is_summarized BOOLEAN DEFAULT 0
-        )
-    ''')
-
-    # Session Summaries Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS session_summaries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            content TEXT,
-            start_chat_id INTEGER,
-            end_chat_id INTEGER,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    # One script = one parse/round-trip for the whole static DDL block
+    cursor.executescript(SCHEMA_DDL)
 
     # --- 2. Run Migrations ---
-    _migrate_schema(cursor)
+    # Migrations + seed are one atomic unit; IMMEDIATE takes the write lock up front
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        _migrate_schema(cursor)
+        _seed(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
+def _seed(cursor):
     # --- 3. Seed Data ---
     cursor.execute('SELECT count(*) FROM users')
     if cursor.fetchone()[0] == 0:
         logger.info("Seeding default user...")
-        default_prefs = json.dumps({
+        default_prefs = orjson.dumps({
             "style": "structural",
             "detail_level": "high",
             "show_prompt_inspector": True
-        })
+        }).decode()
         cursor.execute(
             "INSERT INTO users (user_id, display_name, workspace, preferences) VALUES (?, ?, ?, ?)",
             ("demo_user", "Jacob", "LocalMIND Lab", default_prefs)
         )
-
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized and checked.")
\ No newline at end of file
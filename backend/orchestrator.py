@@ -1,38 +1,69 @@
 # backend/orchestrator.py
 import json
+import asyncio
 import logging
 
+from .database import run_read
 from .session_manager import SessionManager 
 
 logger = logging.getLogger(__name__)
 
+# The "Inspector View" prompt skeleton.
+# This formatting makes it easy for the human to read in the UI.
+# Only the variable fields are filled per request; the section headers are built once at import.
+_PROMPT_TMPL = """=== SYSTEM ===
+{sys}
+
+=== IDENTITY ===
+{identity_block}
+
+=== PREVIOUS SESSION CONTEXT ===
+(Summary of earlier conversation)
+{session_context}
+
+=== LONG-TERM MEMORY (RAG) ===
+{ltm}
+
+=== RETRIEVED DOCUMENTS ===
+{rag}
+
+=== RECENT HISTORY ===
+{hist_str}
+=== CURRENT MESSAGE ===
+User: {current_message}
+
+Assistant:"""
+
 class Orchestrator:
-    def __init__(self, profiles_module):
+    def __init__(self, profiles_module, ollama_client=None):
         self.profiles = profiles_module
         # Initialize the manager to handle the "Deep Past"
-        self.session_manager = SessionManager()
+        self.session_manager = SessionManager(ollama_client)
 
-    def build_context_schema(self, user_message, model_name, system_prompt_override, memories, rag_context, history):
+    async def build_context_schema(self, user_message, model_name, system_prompt_override, memories, rag_context, history):
         """
         Assembles all context sources into a structured schema.
+        The SQLite lookups (profiles + session summary) run concurrently on the DB reader pool.
         """
-        user_profile = self.profiles.get_user_profile()
-        model_profile = self.profiles.get_model_profile(model_name)
+        user_profile, model_profile, session_summary_block = await asyncio.gather(
+            run_read(self.profiles.get_user_profile),
+            run_read(self.profiles.get_model_profile, model_name),
+            run_read(self.session_manager.get_session_summary),
+        )
         
         # Use override if provided, else use model default, else use app default
         sys_prompt = system_prompt_override or model_profile.get("base_system_prompt", "You are a helpful assistant.")
 
-        # [NEW] Fetch the "Deep Past" (Session Summaries)
+        # [NEW] The "Deep Past" (Session Summaries)
         # This is the "Falling Edge" that we have compacted.
-        session_summary_block = self.session_manager.get_session_summary()
         if not session_summary_block:
             session_summary_block = "New session started."
 
         schema = {
             "meta": {
                 "user_profile": user_profile,
-                "model_profile": model_profile,
-                "token_estimate": len(user_message) // 4 + 500 # Rough proxy
+                "model_profile": model_profile
+                # "token_estimate" is filled in by estimate_tokens() once the prompt is rendered
             },
             "system": sys_prompt,
             "identity": {
@@ -74,35 +105,28 @@ class Orchestrator:
         # Format history (The Raw Buffer)
         # We process the entire 'history' list passed to us, assuming the 
         # SessionManager or Main Loop has already handled the window size.
-        hist_str = ""
-        for h in schema['history']:
-            role = "User" if h['role'] == 'user' else "Assistant"
-            content = h['content']
-            hist_str += f"{role}: {content}\n"
-
-        # Assemble the "Inspector View" Prompt
-        # This formatting makes it easy for the human to read in the UI
-        final_prompt = f"""=== SYSTEM ===
-{sys}
+        hist_str = "".join(
+            f"{'User' if h['role'] == 'user' else 'Assistant'}: {h['content']}\n"
+            for h in schema['history']
+        )
 
-=== IDENTITY ===
-{identity_block}
-
-=== PREVIOUS SESSION CONTEXT ===
-(Summary of earlier conversation)
-{session_context}
-
-=== LONG-TERM MEMORY (RAG) ===
-{ltm}
-
-=== RETRIEVED DOCUMENTS ===
-{rag}
-
-=== RECENT HISTORY ===
-{hist_str}
-=== CURRENT MESSAGE ===
-User: {schema['current_message']}
-
-Assistant:"""
+        # Assemble the "Inspector View" Prompt from the precompiled skeleton
+        final_prompt = _PROMPT_TMPL.format_map({
+            "sys": sys,
+            "identity_block": identity_block,
+            "session_context": session_context,
+            "ltm": ltm,
+            "rag": rag,
+            "hist_str": hist_str,
+            "current_message": schema['current_message'],
+        })
         
-        return final_prompt
\ No newline at end of file
+        return final_prompt
+
+    @staticmethod
+    def estimate_tokens(final_prompt):
+        """
+        Rough token count (~4 chars per token) of the rendered prompt.
+        Measured on the real prompt, so no fixed overhead fudge is needed.
+        """
+        return len(final_prompt) // 4
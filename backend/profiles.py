@@ -1,21 +1,37 @@
-import json
+import orjson
 import sqlite3
+import functools
 from backend.database import get_db_connection
 
+# Profiles change on the order of minutes, but are read on every chat request.
+# Both lookups are memoized; call invalidate_profile_cache() after any mutation.
+# NOTE: cached dicts are shared between callers -- treat them as read-only.
+
+# Keep the SQL text constant so sqlite3's per-connection statement cache reuses the plan.
+# Columns are listed explicitly because rows are unpacked positionally.
+_USER_SQL = 'SELECT user_id, display_name, workspace, preferences FROM users WHERE user_id = ?'
+_MODEL_SQL = 'SELECT model_id, display_name, context_limit, base_system_prompt FROM model_configs WHERE model_id = ?'
+
+def _fetch_one_tuple(sql, params):
+    """Runs a single-row lookup returning a plain tuple (no sqlite3.Row name lookups)."""
+    cursor = get_db_connection().cursor()
+    cursor.row_factory = None
+    return cursor.execute(sql, params).fetchone()
+
+@functools.lru_cache(maxsize=64)
 def get_user_profile(user_id="demo_user"):
     """
-    Fetch user profile from SQLite.
+    Fetch user profile from SQLite (cached, preferences already parsed).
     """
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
-    conn.close()
+    user = _fetch_one_tuple(_USER_SQL, (user_id,))
 
     if user:
+        db_user_id, display_name, workspace, preferences = user
         return {
-            "user_id": user["user_id"],
-            "display_name": user["display_name"],
-            "workspace": user["workspace"],
-            "preferences": json.loads(user["preferences"]) if user["preferences"] else {}
+            "user_id": db_user_id,
+            "display_name": display_name,
+            "workspace": workspace,
+            "preferences": orjson.loads(preferences) if preferences else {}
         }
     else:
         # Fallback / Error handling
@@ -26,21 +42,21 @@ def get_user_profile(user_id="demo_user"):
             "preferences": {}
         }
 
+@functools.lru_cache(maxsize=64)
 def get_model_profile(model_name):
     """
-    Fetch model profile from SQLite or generate default.
+    Fetch model profile from SQLite or generate default (cached).
     """
     # Check DB first
-    conn = get_db_connection()
-    db_model = conn.execute('SELECT * FROM model_configs WHERE model_id = ?', (model_name,)).fetchone()
-    conn.close()
+    db_model = _fetch_one_tuple(_MODEL_SQL, (model_name,))
 
     if db_model:
+        model_id, display_name, context_limit, base_system_prompt = db_model
         return {
-            "model_id": db_model["model_id"],
-            "display_name": db_model["display_name"],
-            "context_limit": db_model["context_limit"],
-            "base_system_prompt": db_model["base_system_prompt"],
+            "model_id": model_id,
+            "display_name": display_name,
+            "context_limit": context_limit,
+            "base_system_prompt": base_system_prompt,
             "prompt_template": "standard_chat" # Hardcoded for now
         }
 
@@ -60,4 +76,9 @@ def get_model_profile(model_name):
         profile["display_name"] = "Qwen 2.5"
         profile["base_system_prompt"] = "You are Qwen, a helpful assistant."
         
-    return profile
\ No newline at end of file
+    return profile
+
+def invalidate_profile_cache():
+    """Drops all cached user/model profiles so the next lookup re-reads SQLite."""
+    get_user_profile.cache_clear()
+    get_model_profile.cache_clear()
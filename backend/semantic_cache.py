@@ -0,0 +1,112 @@
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURATION
+# How many exact (model, prompt) -> response pairs to keep in process memory
+RESPONSE_CACHE_SIZE = 256
+# Retrieval results are reused only for near-identical queries (the answer to a similar
+# question may be wrong, but its RAG documents are still the right ones at this threshold)
+RETRIEVAL_THRESHOLD = 0.97
+RETRIEVAL_SIZE = 512
+
+class ResponseCache:
+    """
+    In-process LRU of model answers keyed by the exact (model, prompt) text.
+    Only useful where whole prompts really repeat (snippet analysis): chat prompts embed
+    the recent history, so no two turns ever share one.
+    """
+    def __init__(self, size: int = RESPONSE_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model: str, prompt: str):
+        key = (model, prompt)
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+            return response
+
+    def put(self, model: str, prompt: str, response: str):
+        with self._lock:
+            self._entries[(model, prompt)] = response
+            self._entries.move_to_end((model, prompt))
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+class RetrievalCache:
+    """
+    Recent RAG results, keyed by exact query text and by query embedding.
+    Embeddings live in a fixed-size ring matrix (unit rows), so a lookup is one
+    matrix-vector product. Not thread-safe: use it from the event loop only.
+    Any write to the RAG collection must call invalidate().
+    """
+    def __init__(self, threshold: float = RETRIEVAL_THRESHOLD, size: int = RETRIEVAL_SIZE, exact_size: int = RESPONSE_CACHE_SIZE):
+        self.threshold = threshold
+        self.size = size
+        self.exact_size = exact_size
+        self.generation = 0  # bumped by invalidate(); results computed under an older one are dropped
+        self._exact = OrderedDict()  # query text -> value
+        self._matrix = None  # (size, dim) float32, allocated on first put
+        self._values = [None] * size
+        self._count = 0
+        self._next = 0
+
+    def invalidate(self):
+        self.generation += 1
+        self._exact.clear()
+        self._count = 0
+        self._next = 0
+
+    def get_exact(self, text: str):
+        value = self._exact.get(text)
+        if value is not None:
+            self._exact.move_to_end(text)
+        return value
+
+    def put_exact(self, text: str, value, generation: int):
+        if generation != self.generation:
+            return
+        self._exact[text] = value
+        self._exact.move_to_end(text)
+        while len(self._exact) > self.exact_size:
+            self._exact.popitem(last=False)
+
+    def lookup(self, embedding):
+        """Returns the value stored for the most similar cached query, or None below the threshold."""
+        if self._count == 0:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or query.shape[0] != self._matrix.shape[1]:
+            return None
+        sims = self._matrix[:self._count] @ (query / norm)
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        return self._values[best]
+
+    def put(self, text: str, embedding, value, generation: int):
+        """Caches `value` for `text` and its embedding, unless the collection changed since `generation`."""
+        if generation != self.generation:
+            return
+        row = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(row)
+        if norm == 0:
+            return
+        if self._matrix is None or self._matrix.shape[1] != row.shape[0]:
+            # First entry (or the embedding model changed): size the ring for this dimension
+            self._matrix = np.zeros((self.size, row.shape[0]), dtype=np.float32)
+            self._count = 0
+            self._next = 0
+        self._matrix[self._next] = row / norm
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+        self.put_exact(text, value, generation)
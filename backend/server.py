@@ -1,22 +1,41 @@
 import os
+import re
+import time
+import bisect
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException, Request
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 import chromadb
 import ollama
+import tiktoken
+import orjson
+import numpy as np
 
 # [NEW] Orchestration Modules
 import backend.profiles as profiles
 from backend.orchestrator import Orchestrator
-from backend.database import init_db, get_db_connection # Added get_db_connection
+from backend.session_manager import clip_message
+from backend.semantic_cache import ResponseCache, RetrievalCache
+from backend.database import init_db, get_db_connection, write_lock, run_read, run_write, record_writes, optimize_db
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Shared Ollama clients: each keeps one keep-alive HTTP connection pool for the whole app
+OLLAMA_TIMEOUT = 120.0  # seconds; generous enough for a cold model load
+aclient = ollama.AsyncClient(timeout=OLLAMA_TIMEOUT)
+client = ollama.Client(timeout=OLLAMA_TIMEOUT)  # blocking paths (model listing)
+
 # --- AUTO-PULL MODELS ---
 REQUIRED_MODELS = [
     "mxbai-embed-large",
@@ -24,48 +43,184 @@ REQUIRED_MODELS = [
     "qwen2:7b-instruct" 
 ]
 
-def check_and_pull_models():
-    """Loops through required models and pulls them if missing."""
-    try:
-        # Robust extraction of installed model names
-        response = ollama.list()
-        model_list = []
-        
-        if isinstance(response, dict) and 'models' in response:
-            model_list = response['models']
-        elif isinstance(response, list):
-            model_list = response
+# --- INSTALLED MODELS (cached) ---
+# Ollama's installed set changes rarely, yet it was re-listed on every /chat, /models
+# and /summarizers call. Cache the normalized names for a short TTL.
+MODEL_LIST_TTL = 30.0  # seconds
+_installed_cache = None  # (fetched_at, names, lookup, sorted_names)
+_installed_lock = threading.Lock()
+
+def _normalize_installed(response) -> list[str]:
+    """Extracts model names from any ollama.list() response shape (dict, list or typed object)."""
+    if isinstance(response, dict) and 'models' in response:
+        model_list = response['models']
+    elif isinstance(response, list):
+        model_list = response
+    else:
+        model_list = getattr(response, 'models', [])
+
+    installed = []
+    for m in model_list:
+        if isinstance(m, dict):
+            name = m.get('name') or m.get('model')
         else:
-            model_list = getattr(response, 'models', [])
-        
-        installed = []
-        for m in model_list:
-            name = m.get('name') if isinstance(m, dict) else getattr(m, 'name', None)
-            if not name:
-                name = m.get('model') if isinstance(m, dict) else getattr(m, 'model', None)
-            if name:
-                installed.append(name)
+            name = getattr(m, 'name', None) or getattr(m, 'model', None)
+        if name:
+            installed.append(name)
+    return installed
+
+def _load_installed_models():
+    """Returns the cached (names, lookup, sorted_names), re-listing at most every MODEL_LIST_TTL seconds."""
+    with _installed_lock:
+        if _installed_cache is not None and time.monotonic() - _installed_cache[0] < MODEL_LIST_TTL:
+            return _installed_cache[1:]
+        return _store_installed(client.list())
 
+def _store_installed(response):
+    """Normalizes an ollama list() response into the cache. Caller holds _installed_lock."""
+    global _installed_cache
+    names = tuple(_normalize_installed(response))
+    # Full name and base name (without the ':tag') -> first installed full name
+    lookup = {}
+    for name in names:
+        lookup.setdefault(name, name)
+        lookup.setdefault(name.split(':')[0], name)
+    # Sorted copy for O(log n) tag-prefix lookups
+    sorted_names = tuple(sorted(names))
+    _installed_cache = (time.monotonic(), names, lookup, sorted_names)
+    return names, lookup, sorted_names
+
+def _fetch_installed_models():
+    """Returns a tuple of installed Ollama model names (cached)."""
+    return _load_installed_models()[0]
+
+def _resolve_installed(model):
+    """Maps a requested model or tag prefix to an installed full name, or None if missing."""
+    _, lookup, sorted_names = _load_installed_models()
+    hit = lookup.get(model)
+    if hit is None:
+        # Partial tags like 'qwen2.5:0.5b' -> 'qwen2.5:0.5b-instruct': names sharing a prefix sort
+        # together, so only the first name at or after it needs checking
+        i = bisect.bisect_left(sorted_names, model)
+        if i < len(sorted_names) and sorted_names[i].startswith(model):
+            hit = sorted_names[i]
+    return hit
+
+def invalidate_model_cache():
+    """Forces the next _fetch_installed_models() call to re-list (e.g. after a pull)."""
+    global _installed_cache, _best_summarizer
+    with _installed_lock:
+        _installed_cache = None
+        _best_summarizer = None
+        _summarizer_hints.clear()
+
+async def check_and_pull_models() -> bool:
+    """Loops through required models and pulls them if missing. Returns False if Ollama couldn't be checked."""
+    try:
+        # List once without blocking the loop; the result also seeds the shared cache
+        response = await aclient.list()
+        with _installed_lock:
+            _store_installed(response)
+        missing = []
         for model in REQUIRED_MODELS:
             # Check if model (or :latest) is present
-            if not any(model in i for i in installed):
-                logger.info(f"Model '{model}' missing. Pulling now... (this may take time)")
-                ollama.pull(model)
-                logger.info(f"Model '{model}' installed.")
+            if _resolve_installed(model) is None:
+                missing.append(model)
             else:
                 logger.info(f"Model '{model}' is ready.")
-                
+
+        for model in missing:
+            logger.info(f"Model '{model}' missing. Pulling now... (this may take time)")
+            await aclient.pull(model)
+            invalidate_model_cache()
+            logger.info(f"Model '{model}' installed.")
+        return True
     except Exception as e:
         logger.warning(f"Could not check/pull models: {e}")
+        return False
 
-# Call this immediately when script loads
-check_and_pull_models()
 init_db() # Initialize SQLite
 
-app = FastAPI()
+# --- STARTUP MODEL CHECK ---
+# Pulling models can take minutes, so it runs in the background after startup instead of
+# at import. Only /chat waits for it; everything else is served immediately.
+# A recent sentinel file lets restarts (and other workers) skip the check entirely;
+# LOCALMIND_FORCE_MODEL_CHECK=1 ignores it.
+MODELS_SENTINEL = "./chroma_db/.models_ready"
+MODELS_SENTINEL_MAX_AGE = 24 * 3600  # seconds
+models_ready = asyncio.Event()
+_model_check_task = None
+
+def _models_recently_checked() -> bool:
+    if os.getenv("LOCALMIND_FORCE_MODEL_CHECK") == "1":
+        return False
+    try:
+        return time.time() - os.path.getmtime(MODELS_SENTINEL) < MODELS_SENTINEL_MAX_AGE
+    except OSError:
+        return False
+
+async def _ensure_models():
+    try:
+        if _models_recently_checked():
+            logger.info("Required models verified recently; skipping the pull check.")
+        elif await check_and_pull_models():
+            os.makedirs(os.path.dirname(MODELS_SENTINEL), exist_ok=True)
+            with open(MODELS_SENTINEL, "w") as f:
+                f.write(str(time.time()))
+        # Resolve the summarizer once so chat requests never have to
+        await asyncio.to_thread(get_best_summarizer)
+    finally:
+        models_ready.set()
+
+def _log_ollama_concurrency():
+    # Parallel main + sidecar calls only help if the Ollama server is allowed to serve them
+    num_parallel = os.getenv('OLLAMA_NUM_PARALLEL', 'unset')
+    max_loaded = os.getenv('OLLAMA_MAX_LOADED_MODELS', 'unset')
+    logger.info(
+        "Ollama concurrency (configure on the Ollama server): "
+        f"OLLAMA_NUM_PARALLEL={num_parallel}, OLLAMA_MAX_LOADED_MODELS={max_loaded}"
+    )
+    if max_loaded == "1":
+        logger.warning("OLLAMA_MAX_LOADED_MODELS=1: the main model and the summarizer will evict each other every turn (recommended: 3).")
+    if num_parallel == "1":
+        logger.warning("OLLAMA_NUM_PARALLEL=1: sidecar and compaction calls queue behind the next reply (recommended: 4).")
+
+# Every handler is async; blocking Chroma/summarizer calls go through asyncio.to_thread, whose
+# default pool (min(32, cpus + 4)) would queue concurrent RAG queries on small machines.
+# SQLite has its own pools (run_read / run_write), so this one only carries Chroma and Ollama I/O.
+TO_THREAD_WORKERS = int(os.getenv("LOCALMIND_THREADS", "64"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _model_check_task, _embed_batcher_task
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=TO_THREAD_WORKERS, thread_name_prefix="localmind-io")
+    )
+    _log_ollama_concurrency()
+    try:
+        # Before serving, so no query ranks against a mix of old and new vectors
+        await asyncio.to_thread(_normalize_stored_embeddings)
+    except Exception as e:
+        logger.error(f"Embedding normalization failed (will retry on next start): {e}")
+    try:
+        await asyncio.wait_for(asyncio.to_thread(_load_encoding), TOKENIZER_LOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Tokenizer still loading; truncating context by characters until it is ready.")
+    _model_check_task = asyncio.create_task(_ensure_models())
+    _embed_batcher_task = asyncio.create_task(_embed_batcher_loop())
+    _start_memory_writer()
+    yield
+    _model_check_task.cancel()
+    _embed_batcher_task.cancel()
+    _embed_batcher_task = None
+    await _stop_memory_writer()
+    optimize_db()
+
+# orjson serializes the larger bodies (history, memories, prompts) several times faster than json
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Initialize Orchestrator
-orchestrator = Orchestrator(profiles)
+orchestrator = Orchestrator(profiles, ollama_client=aclient)
 
 # DEFINE YOUR TRUSTED SUMMARIZERS HERE (Smallest to Largest)
 PREFERRED_SUMMARIZERS = [
@@ -76,33 +231,25 @@ PREFERRED_SUMMARIZERS = [
     "phi3",                   # Decent fallback, but larger (2.4GB)
 ]
 
+# Keep the summarizer resident between turns so sidecar calls never pay a model load
+SUMMARIZER_KEEP_ALIVE = "30m"
+
+# The selected summarizer is memoized for the process; invalidate_model_cache() resets it
+_best_summarizer = None
+
 def get_best_summarizer():
     """Finds the first available model from the preferred list."""
+    global _best_summarizer
+    if _best_summarizer is not None:
+        return _best_summarizer
     try:
-        # Get list of installed models
-        response = ollama.list()
-        
-        # Normalize the list to just model names
-        installed_models = []
-        if isinstance(response, dict) and 'models' in response:
-            installed_models = [m['name'] for m in response['models']]
-        elif isinstance(response, list):
-            installed_models = [m['name'] for m in response]
-        else:
-            # Fallback for object-based responses
-            temp_list = getattr(response, 'models', [])
-            installed_models = []
-            for m in temp_list:
-                name = m.get('name') if isinstance(m, dict) else getattr(m, 'name', None)
-                if name: installed_models.append(name)
-        
-        # Find the first match
+        # Find the first match (exact, ignoring ':latest', or tag prefix)
         for pref in PREFERRED_SUMMARIZERS:
-            # Check for exact match or match ignoring ':latest'
-            for installed in installed_models:
-                if installed.startswith(pref): 
-                    logger.info(f"Summarizer selected: {installed}")
-                    return installed
+            installed = _resolve_installed(pref)
+            if installed:
+                logger.info(f"Summarizer selected: {installed}")
+                _best_summarizer = installed
+                return installed
                     
         # Fallback if nothing found (will likely trigger a pull error, which is fine)
         logger.warning("No preferred summarizer found. Defaulting to qwen2.5:0.5b-instruct")
@@ -112,6 +259,24 @@ def get_best_summarizer():
         logger.error(f"Error selecting summarizer: {e}")
         return "qwen2.5:0.5b-instruct"
 
+# Request-supplied summarizer names (e.g. a bare 'llama3.2') -> installed full name
+_summarizer_hints = {}
+
+def resolve_summarizer(hint: str | None = None):
+    """Returns the installed model to summarize with: the request's choice if given, else the best available."""
+    if not hint:
+        return get_best_summarizer()
+    resolved = _summarizer_hints.get(hint)
+    if resolved is None:
+        try:
+            resolved = _resolve_installed(hint)
+        except Exception as e:
+            logger.warning(f"Could not resolve summarizer '{hint}': {e}")
+        if resolved is None:
+            return hint  # Not installed (or Ollama unreachable); let the chat call report it
+        _summarizer_hints[hint] = resolved
+    return resolved
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -119,11 +284,228 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Compress large JSON bodies (rendered prompts, history, memory lists)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+# Token streams opt out of gzip, which would otherwise buffer them
+STREAM_HEADERS = {"Content-Encoding": "identity"}
 
 # --- INIT DATABASE ---
 # We initialize this early so endpoints can use it
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_or_create_collection(name="local_mind_rag")
+# Embedded Chroma is single-writer: one process (uvicorn without --workers) owns ./chroma_db.
+# Multi-worker deployments should point every worker at a Chroma server via CHROMA_HOST.
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+if CHROMA_HOST:
+    chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=int(os.getenv("CHROMA_PORT", "8000")))
+else:
+    chroma_client = chromadb.PersistentClient(path="./chroma_db")
+# HNSW tuning: a deeper graph build and search beam for better recall on a small corpus
+HNSW_PARAMS = {"hnsw:construction_ef": 200, "hnsw:search_ef": 100, "hnsw:M": 16}
+# Embeddings always come from Ollama, so Chroma's default embedder is never needed
+collection = chroma_client.get_or_create_collection(name="local_mind_rag", metadata=HNSW_PARAMS, embedding_function=None)
+# Snippet answers, keyed by the exact (model, prompt)
+response_cache = ResponseCache()
+# RAG results for recent (near-)identical queries; invalidated on every write to `collection`
+retrieval_cache = RetrievalCache()
+
+# Memories written before the switch to /api/embed hold unnormalized vectors. The collection
+# ranks by l2 distance, where a vector's norm outweighs its direction, so they are rescaled to
+# unit length once (the marker file records that it ran; rescaling is idempotent anyway).
+EMBEDDINGS_NORMALIZED_MARKER = "./chroma_db/.embeddings_normalized"
+NORMALIZE_PAGE_SIZE = 500
+
+def _normalize_stored_embeddings():
+    if os.path.exists(EMBEDDINGS_NORMALIZED_MARKER):
+        return
+    updated = 0
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings"], limit=NORMALIZE_PAGE_SIZE, offset=offset)
+        if not page['ids']:
+            break
+        vectors = np.asarray(page['embeddings'], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1)
+        stale = np.flatnonzero((norms > 0) & (np.abs(norms - 1.0) > 1e-3))
+        if stale.size:
+            collection.update(
+                ids=[page['ids'][i] for i in stale],
+                embeddings=(vectors[stale] / norms[stale, None]).tolist()
+            )
+            updated += stale.size
+        offset += len(page['ids'])
+    if updated:
+        retrieval_cache.invalidate()
+        logger.info(f"Normalized {updated} legacy memory embeddings to unit length.")
+    os.makedirs(os.path.dirname(EMBEDDINGS_NORMALIZED_MARKER), exist_ok=True)
+    with open(EMBEDDINGS_NORMALIZED_MARKER, "w") as f:
+        f.write(str(time.time()))
+
+# --- IDS ---
+# Memory ids are sliced from a pooled os.urandom buffer: one syscall per 512 ids
+_ID_BYTES = 8
+_rand_buf = b""
+_rand_off = 0
+_rand_lock = threading.Lock()
+
+def new_id() -> str:
+    """Returns a random 16-hex-char id."""
+    global _rand_buf, _rand_off
+    with _rand_lock:
+        if _rand_off + _ID_BYTES > len(_rand_buf):
+            _rand_buf = os.urandom(4096)
+            _rand_off = 0
+        chunk = _rand_buf[_rand_off:_rand_off + _ID_BYTES]
+        _rand_off += _ID_BYTES
+    return chunk.hex()
+
+# --- EMBEDDINGS ---
+# A message is embedded by /build_prompt and again by /infer_with_prompt (and by /chat on retries);
+# recent query vectors are kept so the same text only goes to Ollama once.
+EMBED_MODEL = 'mxbai-embed-large'
+EMBED_CACHE_SIZE = 512
+# Vectors are kept as float32 arrays: 4 KB each for mxbai's 1024 dims, vs ~32 KB as a list of floats
+_embed_cache = OrderedDict()  # text -> np.ndarray (treat as read-only)
+
+async def _embed_batch(texts) -> list[list[float]]:
+    """Embeds several texts with a single /api/embed round trip."""
+    try:
+        response = await aclient.embed(model=EMBED_MODEL, input=list(texts))
+        return response['embeddings']
+    except (AttributeError, ollama.ResponseError) as e:
+        # Older ollama client / server without /api/embed: one legacy call per text
+        logger.warning(f"Batch embedding unavailable, embedding one by one: {e}")
+        responses = await asyncio.gather(
+            *(aclient.embeddings(model=EMBED_MODEL, prompt=text) for text in texts)
+        )
+        # The legacy endpoint doesn't normalize; scale to unit length like /api/embed so the
+        # l2-space collection ranks by direction (see _normalize_stored_embeddings)
+        vectors = np.asarray([r['embedding'] for r in responses], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms > 0, norms, 1.0)).tolist()
+
+async def _collect_batch(queue: asyncio.Queue, max_items: int, max_wait: float):
+    """Waits for one item, then gathers more for up to `max_wait` seconds (at most `max_items` total)."""
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + max_wait
+    while len(batch) < max_items:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+# Single-text embeddings from concurrent requests are coalesced into one /api/embed call.
+# A lone request waits at most EMBED_BATCH_WAIT for company.
+EMBED_BATCH_SIZE = 16
+EMBED_BATCH_WAIT = 0.008  # seconds
+_embed_queue = asyncio.Queue()  # (text, future)
+_embed_batcher_task = None
+
+async def _embed_batcher_loop():
+    while True:
+        batch = await _collect_batch(_embed_queue, EMBED_BATCH_SIZE, EMBED_BATCH_WAIT)
+        texts = list(dict.fromkeys(text for text, _ in batch))  # identical texts are embedded once
+        try:
+            vectors = dict(zip(texts, await _embed_batch(texts)))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        for text, future in batch:
+            if not future.done():  # the caller may have been cancelled
+                future.set_result(vectors[text])
+
+async def _embed_one(text: str) -> list[float]:
+    """Embeds one text through the batcher (directly if it isn't running, e.g. outside the app)."""
+    if _embed_batcher_task is None:
+        return (await _embed_batch([text]))[0]
+    future = asyncio.get_running_loop().create_future()
+    _embed_queue.put_nowait((text, future))
+    return await future
+
+async def _embed(text: str) -> np.ndarray:
+    """Returns the embedding for `text`, reusing recently computed vectors."""
+    embedding = _embed_cache.get(text)
+    if embedding is not None:
+        _embed_cache.move_to_end(text)
+        return embedding
+    embedding = np.asarray(await _embed_one(text), dtype=np.float32)
+    _embed_cache[text] = embedding
+    if len(_embed_cache) > EMBED_CACHE_SIZE:
+        _embed_cache.popitem(last=False)
+    return embedding
+
+# --- TOKEN BUDGETING ---
+# Retrieved context is capped by real token count rather than a fixed character slice.
+CONTEXT_TOKEN_BUDGET = 3000
+# Local models aren't known to tiktoken; cl100k is close enough for budgeting. Its BPE file may
+# have to be downloaded, so it is loaded once at startup; offline it stays None and the
+# budget falls back to ~4 characters per token.
+TOKENIZER_LOAD_TIMEOUT = 10.0  # seconds lifespan waits; a slower download still lands later
+_encoding = None
+
+def _load_encoding():
+    global _encoding
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, truncating context by characters: {e}")
+
+def _join_within_budget(docs, max_tokens: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Joins retrieved docs with newlines, cutting each to the tokens still left in the budget."""
+    enc = _encoding
+
+    parts = []
+    remaining = max_tokens
+    for doc in docs:
+        if remaining <= 0:
+            break
+        if enc is None:
+            part = doc[:remaining * 4]
+            remaining -= (len(part) + 3) // 4
+        else:
+            tokens = enc.encode(doc)
+            part = doc if len(tokens) <= remaining else enc.decode(tokens[:remaining])
+            remaining -= len(tokens)
+        if len(part) < len(doc):
+            # The budget ran out inside this doc: end on its last complete line when there is one
+            cut = part.rfind("\n")
+            if cut > 0:
+                part = part[:cut]
+        parts.append(part)
+    return "\n".join(parts)
+
+# --- CHAT LOG HELPERS (blocking; dispatch via run_read / run_write from async code) ---
+
+# Newest first (served by idx_chats_session_id). One constant string, so sqlite3's
+# per-connection statement cache reuses the prepared statement on every call.
+_HISTORY_SQL = "SELECT role, content FROM chats WHERE session_id = ? ORDER BY id DESC LIMIT ?"
+_INSERT_CHAT_SQL = "INSERT INTO chats (session_id, role, content, model_used) VALUES (?, ?, ?, ?)"
+
+def _fetch_recent_history(limit: int = 20, session_id: str = "default_session"):
+    """Returns the last `limit` chat turns in chronological order (Oldest -> Newest)."""
+    cursor = get_db_connection().cursor()
+    cursor.row_factory = None  # plain tuples; no sqlite3.Row per turn
+    rows = cursor.execute(_HISTORY_SQL, (session_id, limit)).fetchall()
+    return [{'role': role, 'content': content} for role, content in rows[::-1]]
+
+def _log_turn(user_msg: str, assistant_msg: str, model: str, session_id: str = "default_session"):
+    """Appends a user/assistant pair to the "Tape of Truth" in a single transaction."""
+    conn = get_db_connection()
+    with write_lock:
+        with conn:  # one commit for both rows
+            conn.executemany(
+                _INSERT_CHAT_SQL,
+                [
+                    (session_id, "user", user_msg, model),
+                    (session_id, "assistant", assistant_msg, model)
+                ]
+            )
+        record_writes(2)
 
 class ChatRequest(BaseModel):
     message: str
@@ -131,16 +513,23 @@ class ChatRequest(BaseModel):
     system_prompt: str
     use_memory: bool = True
     summarizer_model: str | None = None
+    stream: bool = False # Stream tokens as text/plain instead of a JSON body
 
 class UpdateMemoryRequest(BaseModel):
     content: str
 
+class MemoryBatchRequest(BaseModel):
+    contents: list[str]
+
 class BuildPromptRequest(BaseModel):
     message: str
     model: str
     system_prompt: str
     use_memory: bool = True
 
+class BuildAndInferRequest(BuildPromptRequest):
+    summarizer_model: str | None = None
+
 class InferenceRequest(BaseModel):
     final_prompt: str
     model: str
@@ -151,6 +540,7 @@ class SnippetRequest(BaseModel):
     snippet: str
     instructions: str
     model: str
+    use_cache: bool = True
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -162,240 +552,492 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 # --- ENDPOINTS ---
 
+def _summarizer_status():
+    available = []
+    missing = []
+    
+    for pref in PREFERRED_SUMMARIZERS:
+        # Check exact or fuzzy match
+        inst = _resolve_installed(pref)
+        if inst:
+            available.append(inst)
+        else:
+            missing.append(pref)
+            
+    return {"available": available, "missing": missing}
+
 @app.get("/summarizers")
-def get_summarizer_status():
+async def get_summarizer_status():
     try:
-        # Get all installed models
-        response = ollama.list()
-        installed_list = []
-        
-        # Robust extraction (same as check_and_pull_models)
-        raw_list = []
-        if isinstance(response, dict) and 'models' in response:
-            raw_list = response['models']
-        elif isinstance(response, list):
-            raw_list = response
-        else:
-            raw_list = getattr(response, 'models', [])
-
-        for m in raw_list:
-            name = m.get('name') if isinstance(m, dict) else getattr(m, 'name', None)
-            if not name:
-                name = m.get('model') if isinstance(m, dict) else getattr(m, 'model', None)
-            if name:
-                installed_list.append(name)
-        
-        available = []
-        missing = []
-        
-        for pref in PREFERRED_SUMMARIZERS:
-            # Check exact or fuzzy match
-            found = False
-            for inst in installed_list:
-                if inst.startswith(pref):
-                    available.append(inst)
-                    found = True
-                    break
-            if not found:
-                missing.append(pref)
-                
-        return {"available": available, "missing": missing}
+        # May re-list installed models (blocking HTTP) when the cache has expired
+        return await asyncio.to_thread(_summarizer_status)
     except Exception as e:
         logger.error(f"Error getting summarizers: {e}")
         return {"available": [], "missing": []}
 
+@app.post("/summarizers/refresh")
+async def refresh_summarizer():
+    """Re-lists installed models and re-selects the summarizer (e.g. after pulling one by hand)."""
+    invalidate_model_cache()
+    return {"summarizer": await asyncio.to_thread(get_best_summarizer)}
+
+RAG_RESULTS = 5
+LTM_RESULTS = 10
+
+async def _retrieve_documents(message: str):
+    """
+    Returns (rag_docs, memory_docs): the top-5 documents for `message` and the LTM block.
+    Served from retrieval_cache when the same or a near-identical query ran recently.
+    """
+    cached = retrieval_cache.get_exact(message)
+    if cached is not None:
+        return cached
+
+    generation = retrieval_cache.generation
+    query_embedding = await _embed(message)
+    cached = retrieval_cache.lookup(query_embedding)
+    if cached is not None:
+        retrieval_cache.put_exact(message, cached, generation)
+        return cached
+
+    # One HNSW search serves both blocks: the best RAG_RESULTS are the retrieved documents,
+    # the next LTM_RESULTS the related long-term memories (no overlap between the two)
+    results = await asyncio.to_thread(
+        collection.query,
+        query_embeddings=[query_embedding],
+        n_results=RAG_RESULTS + LTM_RESULTS,
+        include=["documents"]
+    )
+    ranked = results['documents'][0] if results['documents'] else []
+    documents = (ranked[:RAG_RESULTS], ranked[RAG_RESULTS:])
+    retrieval_cache.put(message, query_embedding, documents, generation)
+    return documents
+
+async def _retrieve_context(message: str):
+    """Returns (rag_context, memories) for the prompt builder."""
+    rag_docs, memory_docs = await _retrieve_documents(message)
+    rag_context = _join_within_budget(rag_docs) if rag_docs else ""
+    memories = [{"content": doc} for doc in memory_docs]
+    return rag_context, memories
+
+async def _gather_context(request: BuildPromptRequest):
+    """Returns (rag_context, memories, history); the RAG lookup and the SQLite read run concurrently."""
+    async def rag():
+        if not request.use_memory:
+            return "", []
+        return await _retrieve_context(request.message)
+
+    (rag_context, memories), history = await asyncio.gather(rag(), run_read(_fetch_recent_history))
+    return rag_context, memories, history
+
+async def _assemble_prompt(request: BuildPromptRequest):
+    """Returns (final_prompt, meta) for one user message. Shared by /build_prompt and /build_and_infer."""
+    # 1. RAG & Memory Lookup + 2. History (FROM SQLITE NOW)
+    rag_context, memories, history = await _gather_context(request)
+
+    # 3. Build Schema
+    schema = await orchestrator.build_context_schema(
+        user_message=request.message,
+        model_name=request.model,
+        system_prompt_override=request.system_prompt,
+        memories=memories,
+        rag_context=rag_context,
+        history=history
+    )
+
+    # 4. Render
+    final_prompt = orchestrator.render_final_prompt(schema)
+    schema["meta"]["token_estimate"] = orchestrator.estimate_tokens(final_prompt)
+    return final_prompt, schema["meta"]
+
 @app.post("/build_prompt")
 async def build_prompt_endpoint(request: BuildPromptRequest):
     try:
-        # 1. RAG & Memory Lookup
-        rag_context = ""
-        memories = []
-        
-        if request.use_memory:
-            # Fetch RAG
-            embedding_response = ollama.embeddings(model='mxbai-embed-large', prompt=request.message)
-            results = collection.query(query_embeddings=[embedding_response['embedding']], n_results=5)
-            if results['documents']:
-                rag_context = "\n".join([doc for doc in results['documents'][0]])[:12000]
-            
-            # Fetch All Memories (for the LTM block)
-            mem_results = collection.get(limit=10)
-            if mem_results['documents']:
-                for doc in mem_results['documents']:
-                    memories.append({"content": doc})
-
-        # 2. Get History (FROM SQLITE NOW)
-        history = []
-        conn = get_db_connection()
-        # Fetch last 20 messages, newest first, then reverse
-        rows = conn.execute("SELECT role, content FROM chats ORDER BY timestamp DESC LIMIT 20").fetchall()
-        conn.close()
-        
-        if rows:
-             # Reverse to get chronological order (Oldest -> Newest)
-            for row in reversed(rows):
-                history.append({'role': row['role'], 'content': row['content']})
-
-        # 3. Build Schema
-        schema = orchestrator.build_context_schema(
-            user_message=request.message,
-            model_name=request.model,
-            system_prompt_override=request.system_prompt,
-            memories=memories,
-            rag_context=rag_context,
-            history=history
-        )
-
-        # 4. Render
-        final_prompt = orchestrator.render_final_prompt(schema)
-        
+        final_prompt, meta = await _assemble_prompt(request)
         return {
             "final_prompt": final_prompt,
-            "meta": schema["meta"]
+            "meta": meta
         }
     except Exception as e:
         logger.error(f"Error building prompt: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/infer_with_prompt")
-async def infer_with_prompt_endpoint(request: InferenceRequest):
+# Sidecar prompt templates are built once at import and filled per turn.
+# They are kept flush-left: indentation would only cost the summarizer extra tokens.
+_CURATOR_PROMPT = """Analyze this interaction and extract only the useful facts or context to remember.
+Ignore pleasantries. If nothing is worth remembering, reply with "NO_DATA".
+
+User: {user_msg}
+AI: {assistant_msg}
+
+Summary:"""
+
+_FACT_PROMPT = """You are a Knowledge Graph extraction tool.
+Analyze the following interaction.
+
+Extract ONLY permanent facts about the user, the project, or the world.
+- DO NOT summarize the conversation flow (e.g. "User asked for help").
+- DO NOT record transient debugging steps.
+- ONLY record facts like "User is building a React app" or "Project uses SQLite".
+
+If there are no new PERMANENT facts, reply exactly with "NO_DATA".
+
+User: {user_msg}
+AI: {assistant_msg}
+
+Fact:"""
+
+_SNIPPET_PROMPT = """SYSTEM: You are a utility assistant. Only use the snippet provided.
+
+SNIPPET:
+{snippet}
+
+INSTRUCTIONS:
+{instructions}
+
+RESPONSE:"""
+
+async def _extract_memory(template: str, user_msg: str, assistant_msg: str, summarizer_model: str | None = None):
+    """
+    Sidecar (BackgroundTasks): asks the summarizer what is worth remembering from one interaction,
+    using _CURATOR_PROMPT (/infer_with_prompt) or _FACT_PROMPT (/chat, /build_and_infer).
+    Anything kept is stored by the memory writer and published to /pending_memories.
+    """
+    if not _worth_summarizing(user_msg, assistant_msg):
+        return
     try:
-        # [NEW] Save User's intent to "Tape of Truth" (Even if via Inspector)
-        conn = get_db_connection()
-        conn.execute(
-            "INSERT INTO chats (session_id, role, content, model_used) VALUES (?, ?, ?, ?)",
-            ("default_session", "user", request.original_message, request.model)
+        summarizer_model = await asyncio.to_thread(resolve_summarizer, summarizer_model)
+        summary_prompt = template.format(user_msg=clip_message(user_msg), assistant_msg=clip_message(assistant_msg))
+        summary_res = await aclient.chat(
+            model=summarizer_model,
+            messages=[{'role': 'user', 'content': summary_prompt}],
+            keep_alive=SUMMARIZER_KEEP_ALIVE
         )
-        conn.commit()
+        summary_text = summary_res['message']['content'].strip()
+
+        if summary_text and "NO_DATA" not in summary_text:
+            _memory_queue.put_nowait(summary_text)
+    except Exception as e:
+        logger.error(f"Sidecar failed: {e}")
 
+# Compaction reads, summarizes and then marks rows, so overlapping runs would summarize the same chunk twice
+_compaction_lock = asyncio.Lock()
+
+async def _compact_session(summarizer_model: str | None = None, session_id: str = "default_session"):
+    """Session compactor (BackgroundTasks): folds the oldest raw turns into a summary chapter if the window is full."""
+    try:
+        async with _compaction_lock:
+            model_name = await asyncio.to_thread(resolve_summarizer, summarizer_model)
+            await orchestrator.session_manager.check_and_compact(session_id=session_id, model_name=model_name)
+    except Exception as e:
+        logger.error(f"Compaction trigger failed: {e}")
+
+# --- SERVER-SENT EVENTS ---
+# JSON endpoints stream when the client sends "Accept: text/event-stream".
+# Each event carries one JSON-encoded token; the stream ends with "data: [DONE]".
+
+def _wants_event_stream(http_request: Request) -> bool:
+    return "text/event-stream" in http_request.headers.get("accept", "")
+
+async def _ollama_tokens(model: str, messages):
+    async for part in await aclient.chat(model=model, messages=messages, stream=True):
+        token = part['message']['content']
+        if token:
+            yield token
+
+async def _single_token(text: str):
+    yield text
+
+def _sse_response(tokens, background_tasks: BackgroundTasks, on_complete=None, persist=None):
+    """
+    Streams `tokens` as SSE. persist(full_text) runs when the stream ends, even if the client
+    disconnected mid-stream; on_complete(full_text) runs afterwards as a background task, only
+    once the last event has been sent.
+    """
+    chunks = []
+
+    async def events():
+        try:
+            async for token in tokens:
+                chunks.append(token)
+                yield f"data: {orjson.dumps(token).decode()}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            if persist is not None and chunks:
+                # Shielded: a disconnect cancels this generator, but the partial turn must still be saved
+                await asyncio.shield(persist("".join(chunks)))
+
+    if on_complete is not None:
+        async def finish():
+            if chunks:
+                await on_complete("".join(chunks))
+        background_tasks.add_task(finish)
+    return StreamingResponse(events(), media_type="text/event-stream", headers=STREAM_HEADERS)
+
+@app.post("/infer_with_prompt")
+async def infer_with_prompt_endpoint(request: InferenceRequest, background_tasks: BackgroundTasks, http_request: Request):
+    try:
         # 1. Raw Inference using the constructed prompt
         messages = [{'role': 'user', 'content': request.final_prompt}]
+
+        if _wants_event_stream(http_request):
+            async def log_turn(assistant_response):
+                await run_write(_log_turn, request.original_message, assistant_response, request.model)
+            async def finish_turn(assistant_response):
+                await _extract_memory(_CURATOR_PROMPT, request.original_message, assistant_response, request.summarizer_model)
+                await _compact_session(request.summarizer_model)
+            return _sse_response(_ollama_tokens(request.model, messages), background_tasks, finish_turn, persist=log_turn)
         
-        response = ollama.chat(model=request.model, messages=messages)
+        response = await aclient.chat(model=request.model, messages=messages)
         assistant_response = response['message']['content']
 
-        # [NEW] Save Assistant's response to "Tape of Truth"
-        conn.execute(
-            "INSERT INTO chats (session_id, role, content, model_used) VALUES (?, ?, ?, ?)",
-            ("default_session", "assistant", assistant_response, request.model)
-        )
-        conn.commit()
-        conn.close()
+        # 2. Save the whole turn to "Tape of Truth" (one transaction)
+        await run_write(_log_turn, request.original_message, assistant_response, request.model)
 
-        # 2. Trigger Sidecar (The Curator)
-        summary_note = None
-        try:
-            summarizer_model = request.summarizer_model or get_best_summarizer()
-            summary_prompt = f"""
-            Analyze this interaction and extract only the useful facts or context to remember.
-            Ignore pleasantries. If nothing is worth remembering, reply with "NO_DATA".
-            
-            User: {request.original_message}
-            AI: {assistant_response}
-            
-            Summary:
-            """
-            summary_res = ollama.chat(model=summarizer_model, messages=[{'role': 'user', 'content': summary_prompt}])
-            summary_text = summary_res['message']['content'].strip()
-            
-            if summary_text and "NO_DATA" not in summary_text:
-                save_embed = ollama.embeddings(model='mxbai-embed-large', prompt=summary_text)
-                new_id = str(os.urandom(8).hex())
-                collection.add(ids=[new_id], embeddings=[save_embed['embedding']], documents=[summary_text])
-                summary_note = {'id': new_id, 'content': summary_text}
-        except Exception as e:
-            logger.error(f"Sidecar failed: {e}")
+        # 3. The Sidecar (The Curator) and compaction run after the response is sent
+        background_tasks.add_task(_extract_memory, _CURATOR_PROMPT, request.original_message, assistant_response, request.summarizer_model)
+        background_tasks.add_task(_compact_session, request.summarizer_model)
 
-        return {"response": assistant_response, "new_memory": summary_note}
+        # The new memory (if any) is published to /pending_memories once the sidecar finishes
+        return {"response": assistant_response, "new_memory": None}
     except Exception as e:
         logger.error(f"Inference failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Identical snippet requests already in flight share one Ollama call instead of queuing duplicates
+_inflight_snippets = {}  # (model, prompt) -> asyncio.Task
+
+async def _run_snippet(model: str, prompt: str) -> str:
+    response = await aclient.chat(model=model, messages=[{'role': 'user', 'content': prompt}])
+    return response['message']['content']
+
 @app.post("/analyze_snippet")
-async def analyze_snippet_endpoint(request: SnippetRequest):
+async def analyze_snippet_endpoint(request: SnippetRequest, background_tasks: BackgroundTasks, http_request: Request):
     try:
-        prompt = f"""SYSTEM: You are a utility assistant. Only use the snippet provided.
+        prompt = _SNIPPET_PROMPT.format(snippet=request.snippet, instructions=request.instructions)
+        
+        # Exact-match only: near-identical snippets can need different answers
+        if request.use_cache:
+            cached = response_cache.get(request.model, prompt)
+            if cached is not None:
+                if _wants_event_stream(http_request):
+                    return _sse_response(_single_token(cached), background_tasks)
+                return {"result": cached}
 
-SNIPPET:
-{request.snippet}
+        if _wants_event_stream(http_request):
+            async def cache_result(result):
+                if request.use_cache:
+                    response_cache.put(request.model, prompt, result)
+            messages = [{'role': 'user', 'content': prompt}]
+            return _sse_response(_ollama_tokens(request.model, messages), background_tasks, cache_result)
 
-INSTRUCTIONS:
-{request.instructions}
+        if not request.use_cache:
+            return {"result": await _run_snippet(request.model, prompt)}
 
-RESPONSE:"""
-        
-        response = ollama.chat(model=request.model, messages=[{'role': 'user', 'content': prompt}])
-        return {"result": response['message']['content']}
+        key = (request.model, prompt)
+        task = _inflight_snippets.get(key)
+        if task is None:
+            task = asyncio.create_task(_run_snippet(request.model, prompt))
+            _inflight_snippets[key] = task
+            task.add_done_callback(lambda _: _inflight_snippets.pop(key, None))
+        # Shielded so one caller disconnecting doesn't cancel the call for the others
+        result = await asyncio.shield(task)
+        response_cache.put(request.model, prompt, result)
+        return {"result": result}
     except Exception as e:
         logger.error(f"Snippet analysis failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/memories/{memory_id}")
-def update_memory(memory_id: str, request: UpdateMemoryRequest):
+async def update_memory(memory_id: str, request: UpdateMemoryRequest):
     try:
         # 1. Re-Embed the new content
-        embedding_response = ollama.embeddings(model='mxbai-embed-large', prompt=request.content)
-        new_embedding = embedding_response['embedding']
+        new_embedding = await _embed_one(request.content)
 
         # 2. Update in Chroma
-        collection.update(
+        await asyncio.to_thread(
+            collection.update,
             ids=[memory_id],
             embeddings=[new_embedding],
             documents=[request.content]
         )
+        retrieval_cache.invalidate()
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Error updating memory: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/memories")
-def get_memories():
+async def get_memories():
     try:
-        results = collection.get()
-        memories = []
-        if results['documents']:
-            for i, doc in enumerate(results['documents']):
-                memories.append({
-                    'id': results['ids'][i],
-                    'content': doc
-                })
-        return {"memories": memories}
+        results = await asyncio.to_thread(collection.get, include=["documents"])
+        return {"memories": [
+            {'id': memory_id, 'content': doc}
+            for memory_id, doc in zip(results['ids'], results['documents'] or [])
+        ]}
     except Exception as e:
         logger.error(f"Error fetching memories: {e}")
         return {"memories": []}
 
+# --- BACKGROUND SIDECAR ---
+# Memories extracted after the response was sent; drained by GET /pending_memories
+_pending_memories = deque(maxlen=100)
+
+# New memories are written to Chroma in micro-batches: one embedding call and a
+# single collection.add per batch instead of one HNSW mutation per chat turn.
+MEMORY_BATCH_SIZE = 8
+MEMORY_BATCH_WAIT = 0.2  # seconds to wait for more items once a batch has started
+_memory_queue = asyncio.Queue()
+_memory_writer_task = None
+
+# Bulk imports are split into chunks of this many documents per collection.add
+MEMORY_INGEST_CHUNK = 100
+
+async def _add_memories(texts):
+    """Embeds and persists memory texts, one collection.add per MEMORY_INGEST_CHUNK. Returns the new ids."""
+    ids = []
+    for start in range(0, len(texts), MEMORY_INGEST_CHUNK):
+        chunk = texts[start:start + MEMORY_INGEST_CHUNK]
+        embeddings = await _embed_batch(chunk)
+        chunk_ids = [new_id() for _ in chunk]
+        await asyncio.to_thread(
+            collection.add,
+            ids=chunk_ids,
+            embeddings=embeddings,
+            documents=list(chunk)
+        )
+        retrieval_cache.invalidate()
+        ids.extend(chunk_ids)
+    return ids
+
+async def _store_memories(texts):
+    """Persists a batch of sidecar memories and publishes them to /pending_memories."""
+    ids = await _add_memories(texts)
+    for memory_id, text in zip(ids, texts):
+        _pending_memories.append({'id': memory_id, 'content': text})
+
+@app.post("/memories/batch")
+async def create_memories_batch(request: MemoryBatchRequest):
+    """Bulk-imports memories with one embedding call and one Chroma insert per chunk."""
+    texts = [text for text in request.contents if text.strip()]
+    if not texts:
+        return {"memories": []}
+    try:
+        ids = await _add_memories(texts)
+        return {"memories": [{'id': memory_id, 'content': text} for memory_id, text in zip(ids, texts)]}
+    except Exception as e:
+        logger.error(f"Batch memory import failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _memory_writer_loop():
+    """Drains the memory queue in batches of up to MEMORY_BATCH_SIZE until it reads the None sentinel."""
+    while True:
+        batch = await _collect_batch(_memory_queue, MEMORY_BATCH_SIZE, MEMORY_BATCH_WAIT)
+        texts = [text for text in batch if text is not None]
+        if texts:
+            try:
+                await _store_memories(texts)
+            except Exception as e:
+                logger.error(f"Memory batch write failed ({len(texts)} items): {e}")
+        if len(texts) < len(batch):
+            return
+
+def _start_memory_writer():
+    global _memory_writer_task
+    _memory_writer_task = asyncio.create_task(_memory_writer_loop())
+
+async def _stop_memory_writer():
+    if _memory_writer_task is not None:
+        # A sentinel instead of cancel(): the writer finishes the batch in hand (already dequeued) first
+        _memory_queue.put_nowait(None)
+        await _memory_writer_task
+    # Flush whatever was queued behind the sentinel so no extracted fact is lost
+    leftovers = []
+    while not _memory_queue.empty():
+        leftovers.append(_memory_queue.get_nowait())
+    if leftovers:
+        try:
+            await _store_memories(leftovers)
+        except Exception as e:
+            logger.error(f"Final memory flush failed: {e}")
+
+@app.get("/pending_memories")
+async def get_pending_memories():
+    """Returns (and clears) memories created by background sidecar runs since the last poll."""
+    notes = []
+    while _pending_memories:
+        notes.append(_pending_memories.popleft())
+    return {"memories": notes}
+
+# Acknowledgements like "ok" / "thanks" never benefit from RAG; skip the embedding pass for them
+_TRIVIAL_RE = re.compile(r'^(ok|okay|thanks|thank you|ty|lol|yes|no|hi|hello)\W*$', re.I)
+MIN_RETRIEVAL_CHARS = 12
+
+def _needs_retrieval(message: str) -> bool:
+    text = message.strip()
+    if len(text) < MIN_RETRIEVAL_CHARS or _TRIVIAL_RE.match(text):
+        logger.debug(f"Skipping RAG lookup for trivial message: {text!r}")
+        return False
+    return True
+
+# Short exchanges and acknowledgements rarely hold a fact worth a second LLM generation
+MIN_SUMMARY_USER_CHARS = 40
+MIN_SUMMARY_AI_CHARS = 120
+
+def _worth_summarizing(user_msg: str, assistant_msg: str) -> bool:
+    user_text, ai_text = user_msg.strip(), assistant_msg.strip()
+    if len(user_text) < MIN_SUMMARY_USER_CHARS and len(ai_text) < MIN_SUMMARY_AI_CHARS:
+        return False
+    return not (_TRIVIAL_RE.match(user_text) or _TRIVIAL_RE.match(ai_text))
+
+def _stream_turn(user_msg: str, model: str, summarizer_model: str | None, messages, background_tasks: BackgroundTasks):
+    """
+    Streams the main model's tokens as plain text (/chat with stream=true, /build_and_infer).
+    The turn is logged when the stream ends (even a partial one, if the client disconnected or
+    pressed Stop); the sidecar summary and compaction run once the stream has finished.
+    """
+    chunks = []
+
+    async def token_stream():
+        try:
+            async for token in _ollama_tokens(model, messages):
+                chunks.append(token)
+                yield token
+        finally:
+            if chunks:
+                # Shielded: a disconnect cancels this generator, but the partial turn must still be saved
+                await asyncio.shield(run_write(_log_turn, user_msg, "".join(chunks), model))
+
+    async def finish_turn():
+        assistant_response = "".join(chunks)
+        if not assistant_response:
+            return
+        await _extract_memory(_FACT_PROMPT, user_msg, assistant_response, summarizer_model)
+        await _compact_session(summarizer_model)
+
+    # Background tasks attached to a StreamingResponse run after the last chunk is sent
+    background_tasks.add_task(finish_turn)
+    return StreamingResponse(token_stream(), media_type="text/plain", headers=STREAM_HEADERS)
+
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest): 
+async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks): 
     logger.info(f"Chat Request -> Model: '{request.model}'")
     
-    try:
-        conn = get_db_connection()
-        
-        # [NEW] 1. SAVE USER MSG TO SQLITE (The Rising Edge Input)
-        conn.execute(
-            "INSERT INTO chats (session_id, role, content, model_used) VALUES (?, ?, ?, ?)",
-            ("default_session", "user", request.message, request.model)
-        )
-        conn.commit()
+    # Only the first requests after boot can actually wait here
+    await models_ready.wait()
 
-        # 2. RETRIEVE CONTEXT (RAG)
+    try:
+        # 1. RETRIEVE CONTEXT (RAG)
+        # The user message is logged together with the reply (one transaction), see step 4
         context_str = ""
-        if request.use_memory:
-            embedding_response = ollama.embeddings(model='mxbai-embed-large', prompt=request.message)
-            query_embedding = embedding_response['embedding']
-            
-            results = collection.query( 
-                query_embeddings=[query_embedding],
-                n_results=5
-            )
-            
-            if results['documents']:
-                raw_context = "\n".join([doc for doc in results['documents'][0]])
-                context_str = raw_context[:12000]
+        if request.use_memory and _needs_retrieval(request.message):
+            rag_docs, _ = await _retrieve_documents(request.message)
+            if rag_docs:
+                context_str = _join_within_budget(rag_docs)
         
-        # 3. PREPARE PROMPT FOR MAIN MODEL
+        # 2. PREPARE PROMPT FOR MAIN MODEL
         full_system_prompt = f"{request.system_prompt}\n\nRELEVANT MEMORIES:\n{context_str}"
         
         messages = [
@@ -403,123 +1045,87 @@ async def chat_endpoint(request: ChatRequest):
             {'role': 'user', 'content': request.message}
         ]
 
-        # 4. MAIN MODEL GENERATION
-        response = ollama.chat(model=request.model, messages=messages)
+        # 3. MAIN MODEL GENERATION
+        if request.stream:
+            return _stream_turn(request.message, request.model, request.summarizer_model, messages, background_tasks)
+
+        response = await aclient.chat(model=request.model, messages=messages)
         assistant_response = response['message']['content']
 
-        # [NEW] 5. SAVE ASSISTANT MSG TO SQLITE (The Rising Edge Output)
-        conn.execute(
-            "INSERT INTO chats (session_id, role, content, model_used) VALUES (?, ?, ?, ?)",
-            ("default_session", "assistant", assistant_response, request.model)
-        )
-        conn.commit()
-        conn.close()
+        # [NEW] 4. SAVE THE TURN TO SQLITE (The Rising Edge, user + assistant in one commit)
+        await run_write(_log_turn, request.message, assistant_response, request.model)
 
-        # 6. SYNCHRONOUS "SIDECAR" SUMMARY
-        summary_note = None
-        try:
-            summarizer_model = request.summarizer_model or get_best_summarizer()
-            summary_prompt = f"""
-            You are a Knowledge Graph extraction tool.
-            Analyze the following interaction.
-            
-            Extract ONLY permanent facts about the user, the project, or the world.
-            - DO NOT summarize the conversation flow (e.g. "User asked for help").
-            - DO NOT record transient debugging steps.
-            - ONLY record facts like "User is building a React app" or "Project uses SQLite".
-            
-            If there are no new PERMANENT facts, reply exactly with "NO_DATA".
-            
-            User: {request.original_message}
-            AI: {assistant_response}
-            
-            Fact:
-            """
-            
-            summary_res = ollama.chat(model=summarizer_model, messages=[{'role': 'user', 'content': summary_prompt}])
-            summary_text = summary_res['message']['content'].strip()
-
-            if summary_text and "NO_DATA" not in summary_text:
-                save_embed = ollama.embeddings(model='mxbai-embed-large', prompt=summary_text)
-                new_id = str(os.urandom(8).hex())
-                collection.add(ids=[new_id], embeddings=[save_embed['embedding']], documents=[summary_text])
-                summary_note = {'id': new_id, 'content': summary_text}
-                
-        except Exception as e:
-            logger.error(f"Summary failed: {e}")
-
-        # 7. TRIGGER SESSION COMPACTOR (Fire and Forget)
-        try: 
-            # [FIX] Correct indentation here
-            orchestrator.session_manager.check_and_compact(
-                session_id="default_session",
-                model_name=request.summarizer_model or "qwen2.5:0.5b-instruct"
-            ) 
-        except Exception as e:
-            logger.error(f"Compaction trigger failed: {e}")
+        # 5. "SIDECAR" SUMMARY (runs after the response is sent)
+        background_tasks.add_task(_extract_memory, _FACT_PROMPT, request.message, assistant_response, request.summarizer_model)
+
+        # 6. TRIGGER SESSION COMPACTOR (Fire and Forget, after the response is sent)
+        background_tasks.add_task(_compact_session, request.summarizer_model)
         
+        # The new memory (if any) is published to /pending_memories once the sidecar finishes
         return {
             "response": assistant_response, 
-            "new_memory": summary_note 
+            "new_memory": None 
         }
 
     except Exception as e:
         logger.error(f"CRITICAL ERROR: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/models")
-def get_models():
+@app.post("/build_and_infer")
+async def build_and_infer_endpoint(request: BuildAndInferRequest, background_tasks: BackgroundTasks):
+    """
+    /build_prompt + /infer_with_prompt in one round trip: the prompt is built server-side
+    and the model's tokens are streamed back as plain text.
+    """
+    # Like /chat, the first requests after boot wait for the model check
+    await models_ready.wait()
+
     try:
-        response = ollama.list()
-        clean_models = []
-        
-        if isinstance(response, dict) and 'models' in response:
-            model_list = response['models']
-        elif isinstance(response, list):
-            model_list = response
-        else:
-            model_list = getattr(response, 'models', [])
+        final_prompt, _ = await _assemble_prompt(request)
+    except Exception as e:
+        logger.error(f"Error building prompt: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        for m in model_list:
-            name = m.get('name') if isinstance(m, dict) else getattr(m, 'name', None)
-            if not name:
-                name = m.get('model') if isinstance(m, dict) else getattr(m, 'model', None)
-            
-            if name:
-                clean_models.append({'name': name})
-        
+    messages = [{'role': 'user', 'content': final_prompt}]
+    return _stream_turn(request.message, request.model, request.summarizer_model, messages, background_tasks)
+
+@app.get("/models")
+async def get_models():
+    try:
+        clean_models = [{'name': name} for name in await asyncio.to_thread(_fetch_installed_models)]
         return {"models": clean_models}
     except Exception as e:
         logger.error(f"Error fetching models: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/history")
-def get_history():
+async def get_history():
     """Fetch recent chat history from SQLite (Tape of Truth)"""
     try:
-        conn = get_db_connection()
-        # Fetch last 20 messages, ordered by newest first
-        rows = conn.execute("SELECT role, content FROM chats ORDER BY timestamp DESC LIMIT 20").fetchall()
-        conn.close()
-        
-        history = []
-        # Reverse them to return in chronological order (Oldest -> Newest)
-        for row in reversed(rows):
-            history.append({'role': row['role'], 'content': row['content']})
-        
-        return {"history": history}
+        return {"history": await run_read(_fetch_recent_history)}
     except Exception as e:
         logger.error(f"Error fetching history: {e}")
         return {"history": []}
 
+@app.post("/admin/reload")
+async def reload_profiles():
+    """Clears the in-memory profile cache (use after editing users / model_configs)."""
+    profiles.invalidate_profile_cache()
+    return {"status": "reloaded"}
+
+@app.post("/admin/embed_cache_clear")
+async def clear_embed_cache():
+    """Drops cached query embeddings and the retrieval results derived from them (e.g. after swapping EMBED_MODEL)."""
+    cleared = len(_embed_cache)
+    _embed_cache.clear()
+    retrieval_cache.invalidate()
+    return {"status": "cleared", "entries": cleared}
+
 # Add this to backend/server.py
 @app.get("/session_summary")
-def get_session_summary_endpoint():
+async def get_session_summary_endpoint():
     try:
-        # We need to instantiate the manager
-        from backend.session_manager import SessionManager
-        mgr = SessionManager()
-        summary = mgr.get_session_summary("default_session")
+        summary = await run_read(orchestrator.session_manager.get_session_summary, "default_session")
         return {"summary": summary}
     except Exception as e:
         logger.error(f"Error fetching session summary: {e}")
@@ -529,29 +1135,8 @@ def get_session_summary_endpoint():
 @app.post("/get_prompt_context")
 async def get_prompt_context_endpoint(request: BuildPromptRequest):
     try:
-        # 1. RAG & Memory
-        rag_context = ""
-        memories = []
-        if request.use_memory:
-            embedding_response = ollama.embeddings(model='mxbai-embed-large', prompt=request.message)
-            results = collection.query(query_embeddings=[embedding_response['embedding']], n_results=5)
-            if results['documents']:
-                rag_context = "\n".join([doc for doc in results['documents'][0]])[:12000]
-            
-            # Fetch LTM
-            mem_results = collection.get(limit=10)
-            if mem_results['documents']:
-                for doc in mem_results['documents']:
-                    memories.append({"content": doc})
-
-        # 2. History (From SQLite)
-        history = []
-        conn = get_db_connection()
-        rows = conn.execute("SELECT role, content FROM chats ORDER BY timestamp DESC LIMIT 20").fetchall()
-        conn.close()
-        if rows:
-            for row in reversed(rows):
-                history.append({'role': row['role'], 'content': row['content']})
+        # 1. RAG & Memory + 2. History (From SQLite)
+        rag_context, memories, history = await _gather_context(request)
 
         return {
             "rag_context": rag_context,
@@ -579,5 +1164,15 @@ async def render_prompt_endpoint(request: RenderRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # With uvicorn[standard] installed, "auto" picks uvloop and httptools
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and not CHROMA_HOST:
+        # Each worker would open ./chroma_db (single-writer) and keep its own caches
+        logger.warning("WEB_CONCURRENCY > 1 needs a shared Chroma server (CHROMA_HOST); running 1 worker.")
+        workers = 1
+    if workers > 1:
+        # Note: pending memories and the in-process caches are still per worker
+        uvicorn.run("backend.server:app", host="0.0.0.0", port=8000, workers=workers, loop="auto", http="auto")
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="auto")
 
@@ -3,7 +3,7 @@ import ollama
 import sqlite3
 from typing import List, Optional
 
-from .database import get_db_connection
+from .database import get_db_connection, write_lock, run_read, run_write, record_writes
 
 logger = logging.getLogger(__name__)
 
@@ -12,11 +12,35 @@ logger = logging.getLogger(__name__)
 ACTIVE_WINDOW_SIZE = 10 
 # When we compact, how many messages do we group together?
 CHUNK_SIZE = 5 
+# Keep the compaction model loaded between runs (it is the same small summarizer the sidecar uses)
+KEEP_ALIVE = "30m"
+# Longest message the summarizer sees verbatim; longer ones (pasted logs, files) keep their
+# head and tail, which bounds the compaction prompt at roughly CHUNK_SIZE * MAX_MSG_CHARS characters
+MAX_MSG_CHARS = 2000
+CLIP_HEAD_CHARS = 1200
+CLIP_TAIL_CHARS = 600
+# Role names as the summarizer sees them (anything that is not the user is the AI)
+_ROLE_LABELS = {"user": "User"}
+
+# Constant statement strings, so each connection's statement cache reuses the prepared statements
+_SUMMARIES_SQL = "SELECT content FROM session_summaries WHERE session_id = ? ORDER BY id ASC"
+# Bounded probe: a row exists at OFFSET ACTIVE_WINDOW_SIZE iff the window has overflowed,
+# so the common "nothing to do" case reads at most ACTIVE_WINDOW_SIZE + 1 index entries
+_WINDOW_OVERFLOW_SQL = "SELECT 1 FROM chats WHERE session_id = ? AND is_summarized = 0 ORDER BY id ASC LIMIT 1 OFFSET ?"
+_OLDEST_UNSUMMARIZED_SQL = "SELECT id, role, content FROM chats WHERE session_id = ? AND is_summarized = 0 ORDER BY id ASC LIMIT ?"
+_INSERT_SUMMARY_SQL = "INSERT INTO session_summaries (session_id, content, start_chat_id, end_chat_id) VALUES (?, ?, ?, ?)"
+
+def clip_message(text: str) -> str:
+    """Shortens text over MAX_MSG_CHARS to its head and tail, so summarizer prefill stays bounded."""
+    if len(text) <= MAX_MSG_CHARS:
+        return text
+    logger.debug(f"Clipped {len(text) - CLIP_HEAD_CHARS - CLIP_TAIL_CHARS} chars from a summarizer input")
+    return f"{text[:CLIP_HEAD_CHARS]}\n...[truncated]...\n{text[-CLIP_TAIL_CHARS:]}"
 
 class SessionManager:
-    def __init__(self):
-        # We could load specific model configs here in the future
-        pass
+    def __init__(self, ollama_client=None):
+        # An ollama.AsyncClient; share the app's (and its connection pool) when one is given
+        self.client = ollama_client or ollama.AsyncClient()
 
     def get_session_summary(self, session_id: str = "default_session") -> str:
         """
@@ -25,10 +49,7 @@ class SessionManager:
         """
         conn = get_db_connection()
         try:
-            rows = conn.execute(
-                "SELECT content FROM session_summaries WHERE session_id = ? ORDER BY id ASC", 
-                (session_id,)
-            ).fetchall()
+            rows = conn.execute(_SUMMARIES_SQL, (session_id,)).fetchall()
             
             if not rows:
                 return ""
@@ -39,47 +60,58 @@ class SessionManager:
         except Exception as e:
             logger.error(f"Error fetching session summary: {e}")
             return ""
-        finally:
-            conn.close()
 
-    def check_and_compact(self, session_id: str = "default_session", model_name: str = "qwen2.5:0.5b-instruct"):
+    def _fetch_compaction_chunk(self, session_id: str):
+        """Read step (reader pool): the oldest CHUNK_SIZE unsummarized rows, or [] while the window has room."""
+        conn = get_db_connection()
+        # We look for messages in this session that have NOT been summarized yet
+        if conn.execute(_WINDOW_OVERFLOW_SQL, (session_id, ACTIVE_WINDOW_SIZE)).fetchone() is None:
+            return []
+        # We order by ID ASC to get the oldest ones first.
+        return conn.execute(_OLDEST_UNSUMMARIZED_SQL, (session_id, CHUNK_SIZE)).fetchall()
+
+    def _save_compaction(self, session_id: str, summary_content: str, ids: List[int]):
+        """Write step (writer lane): stores the chapter and marks its rows, in one transaction."""
+        conn = get_db_connection()
+        placeholders = ','.join('?' * len(ids))
+        with write_lock:
+            try:
+                # A. Insert the new chapter
+                conn.execute(_INSERT_SUMMARY_SQL, (session_id, summary_content, ids[0], ids[-1]))
+
+                # B. Mark the original rows as 'is_summarized' so they aren't processed again
+                conn.execute(
+                    f"UPDATE chats SET is_summarized = 1 WHERE id IN ({placeholders})",
+                    ids
+                )
+
+                conn.commit()
+            except Exception:
+                # The connection is shared with later requests, so never leave a half-open transaction on it
+                conn.rollback()
+                raise
+            record_writes(1 + len(ids))
+
+    async def check_and_compact(self, session_id: str = "default_session", model_name: str = "qwen2.5:0.5b-instruct"):
         """
         Checks if the unsummarized raw history exceeds our window.
         If so, it takes the oldest chunk, summarizes it via Ollama, and marks it as done.
+        SQLite work goes through run_read / run_write; the summarizer call is async.
         """
-        conn = get_db_connection()
         try:
-            # 1. Count unsummarized messages
-            # We look for messages in this session that have NOT been summarized yet
-            count_query = "SELECT COUNT(*) FROM chats WHERE session_id = ? AND is_summarized = 0"
-            count = conn.execute(count_query, (session_id,)).fetchone()[0]
-
-            # If we are within the safe window, do nothing
-            if count <= ACTIVE_WINDOW_SIZE:
-                return
-
-            # 2. We need to compact. Fetch the oldest X unsummarized messages.
-            # We order by ID ASC to get the oldest ones first.
-            rows_to_compact = conn.execute(
-                f"SELECT id, role, content FROM chats WHERE session_id = ? AND is_summarized = 0 ORDER BY id ASC LIMIT {CHUNK_SIZE}",
-                (session_id,)
-            ).fetchall()
-
+            # 1. Probe the window and fetch the oldest X unsummarized messages if it overflowed
+            rows_to_compact = await run_read(self._fetch_compaction_chunk, session_id)
             if not rows_to_compact:
                 return
 
-            # 3. Format them for the Summarizer
-            text_block = ""
-            start_id = rows_to_compact[0]['id']
-            end_id = rows_to_compact[-1]['id']
-            
-            for row in rows_to_compact:
-                # Normalize role names for the LLM context
-                role_label = "User" if row['role'] == 'user' else "AI"
-                text_block += f"{role_label}: {row['content']}\n"
+            # 2. Format them for the Summarizer
+            ids = [row['id'] for row in rows_to_compact]
+            text_block = "\n".join(
+                f"{_ROLE_LABELS.get(row['role'], 'AI')}: {clip_message(row['content'])}" for row in rows_to_compact
+            ) + "\n"
 
-            # 4. Generate Summary via Ollama
-            logger.info(f"Compacting session history (IDs {start_id}-{end_id})...")
+            # 3. Generate Summary via Ollama
+            logger.info(f"Compacting session history (IDs {ids[0]}-{ids[-1]})...")
             
             prompt = f"""
             Compress the following conversation segment into a single concise paragraph.
@@ -92,30 +124,12 @@ class SessionManager:
             SUMMARY:
             """
             
-            response = ollama.chat(model=model_name, messages=[{'role': 'user', 'content': prompt}])
+            response = await self.client.chat(model=model_name, messages=[{'role': 'user', 'content': prompt}], keep_alive=KEEP_ALIVE)
             summary_content = response['message']['content'].strip()
 
-            # 5. Save Summary & Update Rows
-            # A. Insert the new chapter
-            conn.execute(
-                "INSERT INTO session_summaries (session_id, content, start_chat_id, end_chat_id) VALUES (?, ?, ?, ?)",
-                (session_id, summary_content, start_id, end_id)
-            )
-            
-            # B. Mark the original rows as 'is_summarized' so they aren't processed again
-            ids = [row['id'] for row in rows_to_compact]
-            placeholders = ','.join(['?'] * len(ids))
-            conn.execute(
-                f"UPDATE chats SET is_summarized = 1 WHERE id IN ({placeholders})",
-                ids
-            )
-            
-            conn.commit()
+            # 4. Save Summary & Update Rows
+            await run_write(self._save_compaction, session_id, summary_content, ids)
             logger.info(f"Session compaction complete. Created summary chapter for IDs {ids}.")
             
         except Exception as e:
             logger.error(f"Session compaction failed: {e}")
-            # Optional: Rollback if you want to be strict, though SQLite auto-rolls back on uncommited connection close usually.
-            conn.rollback()
-        finally:
-            conn.close()
\ No newline at end of file
@@ -23,6 +23,18 @@ export const getMemories = async (): Promise<MemoryItem[]> => {
   }
 };
 
+// [NEW] Memories created by the background sidecar since the last poll
+export const getPendingMemories = async (): Promise<MemoryItem[]> => {
+  try {
+    const response = await fetch(`${API_URL}/pending_memories`);
+    const data = await response.json();
+    return data.memories;
+  } catch (error) {
+    console.error("Failed to fetch pending memories:", error);
+    return [];
+  }
+};
+
 export const updateMemory = async (id: string, content: string): Promise<boolean> => {
 try {
 const response = await fetch(`${API_URL}/memories/${id}`, {
@@ -70,15 +82,6 @@ body: JSON.stringify({ model, message, system_prompt, use_memory })
 return await response.json();
 };
 
-export const inferWithPrompt = async (final_prompt: string, model: string, original_message: string, summarizer_model: string) => {
-const response = await fetch(`${API_URL}/infer_with_prompt`, {
-method: 'POST',
-headers: { 'Content-Type': 'application/json' },
-body: JSON.stringify({ final_prompt, model, original_message, summarizer_model })
-});
-return await response.json();
-};
-
 export const analyzeSnippet = async (snippet: string, instructions: string, model: string) => {
 const response = await fetch(`${API_URL}/analyze_snippet`, {
 method: 'POST',
@@ -88,31 +91,66 @@ body: JSON.stringify({ snippet, instructions, model })
 return await response.json();
 };
 
-export const sendChat = async (model: string, message: string, system_prompt: string, use_memory: boolean, summarizer_model: string) => {
-    try {
-      const response = await fetch(`${API_URL}/chat`, {
+// [NEW] Streams /chat: calls onToken for each chunk, resolves with the full text
+export const streamChat = async (model: string, message: string, system_prompt: string, use_memory: boolean, summarizer_model: string, onToken: (token: string) => void, signal?: AbortSignal): Promise<string> => {
+    const response = await fetch(`${API_URL}/chat`, {
         method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          model,
-          message,
-          system_prompt,
-          use_memory,
-          summarizer_model // [NEW] Sending the choice
-        })
-      });
-
-      if (!response.ok) {
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ model, message, system_prompt, use_memory, summarizer_model, stream: true }),
+        signal
+    });
+
+    if (!response.ok || !response.body) {
         throw new Error("Backend request failed");
-      }
-      const data = await response.json();
-      return data; 
-    } catch (error) {
-        console.error("Error in sendChat:", error);
-        throw error;
     }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let fullText = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        const token = decoder.decode(value, { stream: true });
+        fullText += token;
+        onToken(token);
+    }
+    return fullText;
+};
+
+// [NEW] Runs an Inspector prompt through /infer_with_prompt, streamed as SSE (requested via Accept)
+export const streamInferWithPrompt = async (final_prompt: string, model: string, original_message: string, summarizer_model: string, onToken: (token: string) => void, signal?: AbortSignal): Promise<string> => {
+    const response = await fetch(`${API_URL}/infer_with_prompt`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+        body: JSON.stringify({ final_prompt, model, original_message, summarizer_model }),
+        signal
+    });
+
+    if (!response.ok || !response.body) {
+        throw new Error("Backend request failed");
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let fullText = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        // Events are separated by a blank line; keep any partial event for the next read
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+        for (const event of events) {
+            if (!event.startsWith('data: ')) continue;
+            const payload = event.slice(6);
+            if (payload === '[DONE]') return fullText;
+            const token: string = JSON.parse(payload);
+            fullText += token;
+            onToken(token);
+        }
+    }
+    return fullText;
 };
 
 export const getModels = async (): Promise<string[]> => {